@@ -17,6 +17,7 @@ setup(
         'joblib>=0.13.2',
         'jupyter-core>=4.4.0',
         'Keras>=2.2.4',
+        'lz4>=2.1.6',
         'numpy>=1.16.1',
         'scikit-learn>=0.20.2',
         'tensorflow>=1.12.0',
@@ -0,0 +1,20 @@
+from unittest import TestCase
+
+from word2morph.data.generators import PrefetchGenerator
+
+
+class TestPrefetchGenerator(TestCase):
+    def test_keeps_order(self):
+        self.assertListEqual(list(PrefetchGenerator(range(100), buffer_size=2)), list(range(100)))
+
+    def test_early_stop(self):
+        res = [item for _, item in zip(range(3), PrefetchGenerator(range(100), buffer_size=2))]
+        self.assertListEqual(res, [0, 1, 2])
+
+    def test_propagates_errors(self):
+        def failing():
+            yield 1
+            raise ValueError('Cannot generate more items')
+
+        with self.assertRaises(ValueError):
+            list(PrefetchGenerator(failing()))
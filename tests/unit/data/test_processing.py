@@ -31,6 +31,20 @@ class TestPreProcessing(TestCase):
         self.assertEqual(len(x), len(y))
         print(x, y)
 
+    def test_one_hot_labels_dtype(self):
+        char_mapping = CharToIdMapping(text='одуматься', include_unknown=True)
+        word_mapping = WordSegmentTypeToIdMapping(segments=[])
+        processor = DataProcessor(char_mapping=char_mapping,
+                                  word_segment_mapping=word_mapping,
+                                  bmes_mapping=BMESToIdMapping())
+
+        samples = [Sample(word='дум', segments=(Segment(segment='дум'),)),
+                   Sample(word='одум', segments=(Segment(segment='о'), Segment(segment='дум')))]
+        inputs, labels = processor.parse(samples)
+        self.assertEqual(inputs.shape, (2, 4))
+        self.assertEqual(labels.shape, (2, 4, processor.nb_classes()))
+        self.assertEqual(labels.dtype, np.float32)
+
     def test_no_segment_type_processing(self):
         char_mapping = CharToIdMapping(text='одуматься', include_unknown=True)
         word_mapping = WordSegmentTypeToIdMapping(segments=[])
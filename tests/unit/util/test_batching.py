@@ -0,0 +1,67 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from word2morph.util.batching import DynamicBatcher
+
+
+class TestDynamicBatcher(TestCase):
+    def test_concurrent_items_are_batched(self):
+        batches = []
+
+        def process(items):
+            time.sleep(0.01)
+            batches.append(items)
+            return [item * 2 for item in items]
+
+        batcher = DynamicBatcher(process, max_batch=8)
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(pool.map(batcher, range(32)))
+
+        self.assertListEqual(results, [item * 2 for item in range(32)])
+        self.assertTrue(all(len(batch) <= 8 for batch in batches))
+        self.assertLess(len(batches), 32)
+
+    def test_single_item_is_not_delayed(self):
+        batcher = DynamicBatcher(lambda items: items, max_batch=64)
+        self.assertEqual(batcher(1), 1)
+
+        start = time.monotonic()
+        for i in range(100):
+            self.assertEqual(batcher(i), i)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_close_stops_the_worker(self):
+        batcher = DynamicBatcher(lambda items: items, max_batch=4)
+        self.assertEqual(batcher(1), 1)
+
+        batcher.close()
+        batcher.worker.join(timeout=1)
+        self.assertFalse(batcher.worker.is_alive())
+        with self.assertRaises(RuntimeError):
+            batcher(2)
+
+    def test_errors_are_propagated(self):
+        def process(items):
+            raise ValueError('Cannot process the batch')
+
+        batcher = DynamicBatcher(process, max_batch=4)
+        with self.assertRaises(ValueError):
+            batcher(1)
+        with self.assertRaises(ValueError):
+            batcher(2)
+
+    def test_errors_only_affect_the_failing_item(self):
+        def process(items):
+            time.sleep(0.01)
+            if -1 in items:
+                raise ValueError('Cannot process -1')
+            return items
+
+        batcher = DynamicBatcher(process, max_batch=8)
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            futures = [pool.submit(batcher, item) for item in list(range(15)) + [-1] + list(range(15, 30))]
+
+        self.assertListEqual([future.result() for i, future in enumerate(futures) if i != 15], list(range(30)))
+        with self.assertRaises(ValueError):
+            futures[15].result()
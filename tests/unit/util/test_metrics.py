@@ -0,0 +1,92 @@
+from unittest import TestCase
+
+import numpy as np
+from sklearn.metrics import roc_auc_score, log_loss, confusion_matrix, precision_recall_fscore_support
+
+from word2morph.util.metrics import Evaluate, BinnedROCAUC, log_loss_sum, macro_precision_recall_f1
+
+
+class TestEvaluate(TestCase):
+    def setUp(self):
+        self.evaluate = Evaluate(data_generator=[], to_sample=None, nb_steps=1)
+
+    def test_word_and_char_accuracy(self):
+        labels = [np.array([[0, 1, 2],
+                            [2, 1, 0]]),
+                  np.array([[1, 1]])]
+        predictions = [np.eye(3)[[[0, 1, 2],
+                                  [2, 1, 1]]],
+                       np.eye(3)[[[1, 1]]]]
+
+        metrics = dict(self.evaluate.evaluate(predictions=predictions, labels=labels))
+        print(metrics)
+        self.assertAlmostEqual(metrics['word_acc'], 2 / 3)
+        self.assertAlmostEqual(metrics['acc'], 7 / 8)
+        self.assertEqual(metrics['confusion_matrix'].shape, (3, 3))
+        self.assertEqual(metrics['confusion_matrix'].sum(), 8)
+
+    def test_word_accuracy_with_different_batch_lengths(self):
+        labels = [np.array([[0, 1, 2, 0]]),
+                  np.array([[1, 0],
+                            [1, 1]]),
+                  np.array([[2]])]
+        predictions = [np.eye(3)[[[0, 1, 2, 0]]],
+                       np.eye(3)[[[1, 0],
+                                  [0, 1]]],
+                       np.eye(3)[[[1]]]]
+
+        metrics = dict(self.evaluate.evaluate(predictions=predictions, labels=labels))
+        self.assertAlmostEqual(metrics['word_acc'], 2 / 4)
+
+
+class TestStreamingMetrics(TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.y_true = rng.randint(0, 4, size=200)
+        self.y_score = rng.rand(200, 4) ** 3
+        self.y_score /= self.y_score.sum(axis=-1, keepdims=True)
+
+    def test_log_loss(self):
+        expected = log_loss(self.y_true, self.y_score, labels=np.arange(4))
+        self.assertAlmostEqual(log_loss_sum(self.y_true, self.y_score) / len(self.y_true), expected)
+
+    def test_precision_recall_f1(self):
+        ''' Class 4 never appears and class 3 is never predicted '''
+        y_pred = np.minimum(self.y_score.argmax(axis=-1), 2)
+        conf = confusion_matrix(self.y_true, y_pred, labels=np.arange(5))
+
+        expected = precision_recall_fscore_support(self.y_true, y_pred, average='macro')[:3]
+        np.testing.assert_almost_equal(macro_precision_recall_f1(conf), expected)
+
+    def test_auc_matches_sklearn(self):
+        auc = BinnedROCAUC(nb_classes=4)
+        for start in range(0, 200, 64):
+            auc.update(self.y_true[start: start + 64], self.y_score[start: start + 64])
+
+        expected = roc_auc_score(self.y_true[:, None] == np.arange(4), self.y_score, average='macro')
+        self.assertAlmostEqual(auc.result(), expected, places=3)
+
+    def test_auc_of_confident_predictions(self):
+        ''' Most of the scores are extremely close to 0 or 1 (like the ones of a trained network) '''
+        rng = np.random.RandomState(1)
+        y_true = rng.randint(0, 10, size=20000)
+        logits = rng.normal(size=(20000, 10))
+        logits[np.arange(20000), y_true] += 2.5
+        logits *= 30
+        y_score = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        y_score = (y_score / y_score.sum(axis=-1, keepdims=True)).astype(np.float32)
+
+        auc = BinnedROCAUC(nb_classes=10)
+        for start in range(0, 20000, 1000):
+            auc.update(y_true[start: start + 1000], y_score[start: start + 1000])
+
+        expected = roc_auc_score(y_true[:, None] == np.arange(10), y_score, average='macro')
+        self.assertAlmostEqual(auc.result(), expected, places=4)
+
+    def test_auc_of_hard_predictions_is_exact(self):
+        y_score = np.eye(4)[self.y_score.argmax(axis=-1)]
+        auc = BinnedROCAUC(nb_classes=4)
+        auc.update(self.y_true, y_score)
+
+        expected = roc_auc_score(self.y_true[:, None] == np.arange(4), y_score, average='macro')
+        self.assertAlmostEqual(auc.result(), expected)
@@ -1,4 +1,4 @@
-from word2morph.api import Word2Morph
+from word2morph.api import Word2Morph, enable_xla
 
 
 __version__ = '1.0.0'
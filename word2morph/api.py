@@ -1,46 +1,124 @@
-from typing import List, Tuple, overload
+import os
+import weakref
+from functools import lru_cache
+from typing import List, Tuple, Dict, Optional, overload
 
 import joblib
 import numpy as np
+import tensorflow as tf
 from keras import Model
+from keras import backend as K
 from keras.utils import CustomObjectScope
-from keras_contrib.layers import CRF
-from keras_contrib.losses import crf_loss
-from keras_contrib.metrics import crf_viterbi_accuracy
 from tqdm import tqdm
 
-from word2morph.data.generators import DataGenerator
+from word2morph.data.generators import PrefetchGenerator
 from word2morph.data.processing import DataProcessor
-from word2morph.entities.dataset import Dataset
-from word2morph.entities.sample import Sample
-from word2morph.models.cnn import CNNModel
-from word2morph.models.rnn import RNNModel
+from word2morph.entities.sample import Sample, Segment
+from word2morph.util.batching import DynamicBatcher
 from word2morph.util.metrics import Evaluate
 from word2morph.util.utils import download
 
 BASE_URL = 'https://github.com/MartinXPN/word2morph/releases/download'
 
 
+def enable_xla():
+    """
+    Makes Keras use a session that compiles the graphs with XLA JIT (fuses the ops of the network)
+    Needs to be called once at startup before any model is created/loaded
+    In TF 1.x the session-level JIT only compiles the ops placed on a GPU,
+    on CPU it has effect only if the environment variable TF_XLA_FLAGS=--tf_xla_cpu_global_jit is set
+    """
+    if tf.get_default_graph().get_operations():
+        raise RuntimeError('XLA needs to be enabled before any model is created')
+
+    ''' Same defaults as the session Keras creates by itself '''
+    config = tf.ConfigProto(allow_soft_placement=True)
+    if os.environ.get('OMP_NUM_THREADS'):
+        num_threads = int(os.environ['OMP_NUM_THREADS'])
+        config.intra_op_parallelism_threads = num_threads
+        config.inter_op_parallelism_threads = num_threads
+
+    config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
+    K.set_session(tf.Session(config=config))
+
+
 class Word2Morph(object):
-    def __init__(self, model: Model, processor: DataProcessor):
+    def __init__(self, model: Model, processor: DataProcessor, cache_size: int = 100000, max_batch: int = 64,
+                 encode_cache_size: int = 65536):
+        """
+        :param model: network that maps char ids to per-char class probabilities
+        :param processor: maps the samples to the network inputs and the network outputs back to samples
+        :param cache_size: number of most recently looked up words (`model[word]`) to keep the predictions for
+        :param max_batch: maximum number of concurrent `model[word]` lookups to run through the network together
+                          (1 disables the batching)
+        :param encode_cache_size: number of most recently encoded words to keep the network inputs for
+        """
         self.model = model
         self.processor = processor
+        self.cache_size = cache_size
+        self.max_batch = max_batch
+        self.encode_cache_size = encode_cache_size
+        self.init_cache()
+
+    def init_cache(self):
+        """
+        (Re)creates the caches and the batcher of single-word lookups, should be called if the model is changed
+        The batcher runs the model in its own thread => the graph of the model is captured from the current thread
+        """
+        ''' Build the predict function once here instead of lazily on the first (possibly concurrent) prediction '''
+        self.model._make_predict_function()
+
+        ''' Stop the worker of the previous batcher (if any) '''
+        if getattr(self, '_batcher', None) is not None:
+            self._batcher.close()
+        self._batcher = None
+
+        predict_word = self._predict_word_unbatched
+        if self.max_batch > 1:
+            graph = tf.get_default_graph()
+            instance = weakref.ref(self)     # The worker thread should not keep this object (and its model) alive
+
+            def predict_words(words: List[str]) -> List[Sample]:
+                with graph.as_default():
+                    return instance()._predict_words(words)
+
+            self._batcher = DynamicBatcher(predict_words, max_batch=self.max_batch)
+            weakref.finalize(self, self._batcher.close)
+            predict_word = self._batcher
+        self._predict_word = lru_cache(maxsize=self.cache_size)(predict_word)
+        self._encode_word = lru_cache(maxsize=self.encode_cache_size)(self._encode_word_uncached)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_predict_word']
+        del state['_batcher']
+        del state['_encode_word']
+        return state
+
+    def __setstate__(self, state):
+        ''' Models saved with older versions might not have all the attributes '''
+        state.setdefault('cache_size', 100000)
+        state.setdefault('max_batch', 64)
+        state.setdefault('encode_cache_size', 65536)
+        self.__dict__.update(state)
+        self.init_cache()
 
     def predict(self, inputs: List[Sample], batch_size: int, verbose: bool = False) -> List[Sample]:
         """
         :param inputs: List of Samples
         :param batch_size: batch size in which to process the data
-        :param verbose: display progress or no
+        :param verbose: display progress or no (the progress is shown per group of words with the same length)
         :return: Predicted samples in the order they were given as an input
         """
-        data_generator = DataGenerator(dataset=Dataset(samples=inputs), processor=self.processor, batch_size=batch_size,
-                                       with_samples=True, shuffle=False)
-
-        predicted_samples: List[Sample] = []
-        for inputs, _, samples in tqdm(data_generator, disable=not verbose):
-            predictions = self.model.predict(inputs)
-            predicted_samples += [self.processor.to_sample(word=sample.word, prediction=prediction)
-                                  for sample, prediction in zip(samples, predictions)]
+        ''' Group the words by their length so that each group is predicted with a single call and without padding '''
+        groups = self._group_by_length([sample.word for sample in inputs])
+        encoded_groups = ((ids, self._encode([inputs[i].word for i in ids])) for ids in groups)
+
+        predicted_samples: List[Optional[Sample]] = [None] * len(inputs)
+        for ids, group_inputs in tqdm(PrefetchGenerator(encoded_groups), total=len(groups), disable=not verbose):
+            predictions = self.model.predict(group_inputs, batch_size=batch_size)
+            for i, prediction in zip(ids, predictions):
+                predicted_samples[i] = self.processor.to_sample(word=inputs[i].word, prediction=prediction)
         return predicted_samples
 
     def evaluate(self, inputs: List[Sample], batch_size: int) -> Tuple[List[Tuple[Sample, Sample]],
@@ -51,14 +129,30 @@ class Word2Morph(object):
         :param batch_size: batch size in which to process the data
         :return: (list of correct predictions, list of wrong predictions, list of all predictions in the input order)
                     each list item is (predicted_sample, correct_sample)
+                    the predictions are the same as the ones of `predict` (words are grouped by length in both)
         """
+        ''' Batches only contain words of the same length (like in predict) => padding does not affect the predictions '''
+        batch_ids = [ids[start: start + batch_size]
+                     for ids in self._group_by_length([sample.word for sample in inputs])
+                     for start in range(0, len(ids), batch_size)]
+        batches = ([inputs[i] for i in ids] for ids in batch_ids)
+        data_generator = (self.processor.parse(batch, convert_one_hot=False) + (batch,) for batch in batches)
+
         ''' Show Evaluation metrics '''
-        data_generator: DataGenerator = DataGenerator(dataset=Dataset(samples=inputs), processor=self.processor,
-                                                      batch_size=batch_size, with_samples=True, shuffle=False)
         evaluate = Evaluate(data_generator=data_generator, to_sample=self.processor.to_sample,
-                            nb_steps=len(data_generator), prepend_str='test_')
+                            nb_steps=len(batch_ids), prepend_str='test_')
         evaluate.model = self.model
-        return evaluate.on_epoch_end(epoch=0)
+        correct, wrong, evaluated_samples = evaluate.on_epoch_end(epoch=0)
+
+        ''' Restore the input order '''
+        order = [i for ids in batch_ids for i in ids]
+        position = {id(sample): i for i, sample in zip(order, evaluated_samples)}
+        predicted_samples: List[Optional[Sample]] = [None] * len(inputs)
+        for i, sample in zip(order, evaluated_samples):
+            predicted_samples[i] = sample
+        correct.sort(key=lambda pair: position[id(pair[0])])
+        wrong.sort(key=lambda pair: position[id(pair[0])])
+        return correct, wrong, predicted_samples
 
     @overload
     def __getitem__(self, item: str) -> Sample:
@@ -69,13 +163,48 @@ class Word2Morph(object):
         ...
 
     def __getitem__(self, item) -> Sample:
-        sample = Sample(word=item, segments=tuple()) if type(item) == str else item
-        inputs, _ = self.processor.parse_one(sample=sample)
-        prediction: np.ndarray = self.model.predict(x=np.array([inputs]))[0]
-        return self.processor.to_sample(word=sample.word, prediction=prediction)
+        word = item if isinstance(item, str) else item.word
+        sample = self._predict_word(word)
+
+        ''' The cached sample is shared between all the lookups of the word => each caller gets its own copy '''
+        return Sample(word=sample.word,
+                      segments=tuple([Segment(segment=s.segment, segment_type=s.type) for s in sample.segments]))
+
+    @staticmethod
+    def _group_by_length(words: List[str]) -> List[List[int]]:
+        """ Indices of the words grouped by the length of the word """
+        length_to_ids: Dict[int, List[int]] = {}
+        for i, word in enumerate(words):
+            length_to_ids.setdefault(len(word), []).append(i)
+        return list(length_to_ids.values())
+
+    def _predict_word_unbatched(self, word: str) -> Sample:
+        return self._predict_words([word])[0]
+
+    def _encode_word_uncached(self, word: str) -> np.ndarray:
+        inputs, _ = self.processor.parse_one(sample=Sample(word=word, segments=()))
+        inputs.flags.writeable = False    # The array is shared through the cache
+        return inputs
+
+    def _encode(self, words: List[str]) -> np.ndarray:
+        """ Network inputs for words of the same length (only the chars are mapped, no labels nor padding) """
+        return np.stack([self._encode_word(word) for word in words])
+
+    def _predict_words(self, words: List[str]) -> List[Sample]:
+        """ Runs the network once for each distinct word length (no padding => same result as one word at a time) """
+        predicted_samples: List[Optional[Sample]] = [None] * len(words)
+        for ids in self._group_by_length(words):
+            predictions: np.ndarray = self.model.predict_on_batch(x=self._encode([words[i] for i in ids]))
+            for i, prediction in zip(ids, predictions):
+                predicted_samples[i] = self.processor.to_sample(word=words[i], prediction=prediction)
+        return predicted_samples
 
-    def save(self, path):
-        joblib.dump(self, filename=path, compress=('lzma', 3))
+    def save(self, path, compress=('lz4', 3)):
+        """
+        :param path: where to save the model
+        :param compress: joblib compression (lz4 is much faster to save/load than lzma, use 0 to disable)
+        """
+        joblib.dump(self, filename=path, compress=compress)
 
     @classmethod
     @overload
@@ -94,7 +223,16 @@ class Word2Morph(object):
 
     @classmethod
     def load_model(cls, path: str = None, url: str = None, locale: str = None, version: str = None) -> 'Word2Morph':
+        """
+        Loads the model either from a local path, an url or the released model for the locale
+        To compile the model with XLA call `enable_xla()` once before loading it
+        """
+        from keras_contrib.layers import CRF
+        from keras_contrib.losses import crf_loss
+        from keras_contrib.metrics import crf_viterbi_accuracy
         from word2morph import __version__
+        from word2morph.models.cnn import CNNModel
+        from word2morph.models.rnn import RNNModel
 
         if locale:
             version = version or __version__
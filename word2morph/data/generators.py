@@ -1,4 +1,6 @@
-from typing import Tuple, Union, List
+from queue import Queue, Full
+from threading import Thread, Event
+from typing import Tuple, Union, List, Iterable, Iterator, TypeVar
 
 import numpy as np
 from keras.utils import Sequence
@@ -7,6 +9,8 @@ from word2morph.entities.dataset import Dataset
 from word2morph.entities.sample import Sample
 from .processing import DataProcessor
 
+T = TypeVar('T')
+
 
 class DataGenerator(Sequence):
     def __init__(self,
@@ -15,10 +19,12 @@ class DataGenerator(Sequence):
                  batch_size: int,
                  with_samples: bool = False,
                  shuffle: bool = True,
-                 drop_remainder: bool = False):
+                 drop_remainder: bool = False,
+                 convert_one_hot: bool = True):
         self.dataset = dataset
         self.processor = processor
         self.with_samples = with_samples
+        self.convert_one_hot = convert_one_hot
         self.batch_size = batch_size
         self.shuffle = shuffle
         self.drop_remainder = drop_remainder
@@ -36,7 +42,7 @@ class DataGenerator(Sequence):
                                                Tuple[np.ndarray, np.ndarray, List[Sample]]]:
         """ Gets batch at position `index` """
         batch = self.dataset[index * self.batch_size: (index + 1) * self.batch_size]
-        res = self.processor.parse(data=batch)
+        res = self.processor.parse(data=batch, convert_one_hot=self.convert_one_hot)
 
         if self.with_samples:
             return res + (batch,)
@@ -49,3 +55,51 @@ class DataGenerator(Sequence):
     def shuffle_data(self):
         assert self.shuffle
         self.dataset.shuffle()
+
+
+class PrefetchGenerator(Iterable[T]):
+    """
+    Iterates over `iterable` in a background thread keeping up to `buffer_size` items ready
+    so that the data preparation overlaps with the consumer (e.g. model.predict)
+    """
+    _END = object()
+
+    def __init__(self, iterable: Iterable[T], buffer_size: int = 4):
+        self.iterable = iterable
+        self.buffer_size = buffer_size
+
+    def __iter__(self) -> Iterator[T]:
+        queue = Queue(maxsize=self.buffer_size)
+        stop = Event()
+
+        def put(item) -> bool:
+            """ Blocks until the item is in the queue or the consumer stopped iterating """
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for item in self.iterable:
+                    if not put((item, None)):
+                        return
+            except Exception as e:
+                put((None, e))
+            put((self._END, None))
+
+        worker = Thread(target=produce, daemon=True)
+        worker.start()
+        try:
+            while True:
+                item, error = queue.get()
+                if error is not None:
+                    raise error
+                if item is self._END:
+                    return
+                yield item
+        finally:
+            stop.set()
@@ -70,7 +70,8 @@ class DataProcessor(object):
         labels = pad_sequences(labels, truncating='post', padding='post')
         assert inputs.shape == labels.shape or labels.shape[1] == 0
         if convert_one_hot:
-            labels = np.eye(self.nb_classes())[labels]
+            ''' float32 is what the network outputs => no float64 one-hot labels that need to be cast '''
+            labels = np.eye(self.nb_classes(), dtype=np.float32)[labels]
         return inputs, labels
 
     def nb_classes(self) -> int:
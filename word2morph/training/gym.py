@@ -126,7 +126,7 @@ class Gym(object):
 
         train_generator = DataGenerator(dataset=self.train_dataset, processor=self.processor, batch_size=batch_size)
         valid_generator = DataGenerator(dataset=self.valid_dataset, processor=self.processor, batch_size=batch_size,
-                                        with_samples=True)
+                                        with_samples=True, convert_one_hot=False)
 
         history = self.model.fit_generator(
             generator=train_generator,
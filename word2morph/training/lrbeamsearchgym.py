@@ -53,7 +53,7 @@ class LearningRateBeamSearchGym(Gym):
 
         train_generator = DataGenerator(dataset=self.train_dataset, processor=self.processor, batch_size=batch_size)
         valid_generator = DataGenerator(dataset=self.valid_dataset, processor=self.processor, batch_size=batch_size,
-                                        with_samples=True)
+                                        with_samples=True, convert_one_hot=False)
 
         best_current_models: List[ModelInstance] = []
         best_prev_models: List[ModelInstance] = []
@@ -0,0 +1,96 @@
+from concurrent.futures import Future
+from queue import Queue, Empty
+from threading import Thread, Lock
+from typing import Callable, List, TypeVar, Generic, Optional, Tuple
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+class DynamicBatcher(Generic[T, R]):
+    """
+    Collects the items submitted from (possibly) many threads and processes them together with a single call
+    The worker never waits for more items: it takes everything that is already queued (up to `max_batch`)
+    and processes it right away, so concurrent requests pile up while the previous batch is being processed
+    """
+    _STOP = object()
+
+    def __init__(self, process_batch: Callable[[List[T]], List[R]], max_batch: int = 64):
+        """
+        :param process_batch: processes a list of items and returns the results in the same order
+        :param max_batch: maximum number of items to process together
+        """
+        self.process_batch = process_batch
+        self.max_batch = max_batch
+        self.queue: Queue = Queue()
+        self.worker: Optional[Thread] = None
+        self.closed = False
+        self.lock = Lock()
+
+    def submit(self, item: T) -> 'Future[R]':
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError('Cannot submit items to a closed batcher')
+            if self.worker is None:
+                self.worker = Thread(target=self.run, daemon=True)
+                self.worker.start()
+            self.queue.put((item, future))
+        return future
+
+    def __call__(self, item: T) -> R:
+        return self.submit(item).result()
+
+    def close(self):
+        """ Stops the worker after it processes the items submitted so far """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            if self.worker is not None:
+                self.queue.put(self._STOP)
+
+    def next_batch(self) -> Tuple[list, bool]:
+        """ :return: (batch, whether the batcher was closed) """
+        item = self.queue.get()
+        if item is self._STOP:
+            return [], True
+
+        batch = [item]
+        while len(batch) < self.max_batch:
+            try:
+                item = self.queue.get_nowait()
+            except Empty:
+                break
+            if item is self._STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def run(self):
+        stop = False
+        while not stop:
+            batch, stop = self.next_batch()
+            if not batch:
+                continue
+
+            items, futures = zip(*batch)
+            try:
+                results = self.process_batch(list(items))
+            except Exception as e:
+                if len(items) == 1:
+                    futures[0].set_exception(e)
+                else:
+                    self.process_one_by_one(items, futures)
+                continue
+
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+    def process_one_by_one(self, items, futures):
+        """ The batch failed => retry each item separately so that only the failing ones get the exception """
+        for item, future in zip(items, futures):
+            try:
+                future.set_result(self.process_batch([item])[0])
+            except Exception as e:
+                future.set_exception(e)
@@ -3,22 +3,94 @@ from typing import Tuple, List, Union
 
 import numpy as np
 from keras.callbacks import Callback
-from sklearn.metrics import (confusion_matrix, precision_score, recall_score, f1_score,
-                             accuracy_score, log_loss, roc_auc_score)
-from sklearn.preprocessing import LabelBinarizer
 
-from word2morph.data.generators import DataGenerator
+from word2morph.data.generators import DataGenerator, PrefetchGenerator
+
+
+def log_loss_sum(y_true: np.ndarray, y_score: np.ndarray, eps: float = 1e-15) -> float:
+    """
+    Sum (not mean) of the per-sample cross-entropy. The scores are clipped and renormalized like in sklearn log_loss
+    :param y_true: label ids of shape (nb_samples,)
+    :param y_score: predicted class scores of shape (nb_samples, nb_classes)
+    """
+    y_score = np.clip(y_score, eps, 1 - eps)
+    y_score = y_score[np.arange(len(y_true)), y_true] / y_score.sum(axis=-1)
+    return float(-np.log(y_score).sum(dtype=np.float64))
+
+
+def macro_precision_recall_f1(conf: np.ndarray) -> Tuple[float, float, float]:
+    """
+    Macro-averaged precision, recall and f1 derived from the confusion matrix (same as in sklearn with average='macro')
+    Only the classes that appear either in the labels or in the predictions are averaged
+    :param conf: confusion matrix where conf[i, j] is the number of samples of class i predicted as j
+    """
+    tp = np.diag(conf).astype(np.float64)
+    nb_predicted, nb_true = conf.sum(axis=0), conf.sum(axis=1)
+    present = (nb_predicted > 0) | (nb_true > 0)
+
+    precision = np.divide(tp, nb_predicted, out=np.zeros_like(tp), where=nb_predicted > 0)
+    recall = np.divide(tp, nb_true, out=np.zeros_like(tp), where=nb_true > 0)
+    f1 = np.divide(2 * precision * recall, precision + recall,
+                   out=np.zeros_like(tp), where=precision + recall > 0)
+    return float(precision[present].mean()), float(recall[present].mean()), float(f1[present].mean())
+
+
+class BinnedROCAUC(object):
+    """
+    One-vs-rest macro AUC that is accumulated batch by batch
+    The scores of each class are kept as histograms of `nb_bins` bins so the memory does not depend on the number
+    of samples. The bins are equally spaced in the logit space (not in [0, 1]) => the confident scores that are
+    very close to 0 or 1 are still told apart. Classes without positive or negative samples are skipped
+    """
+    def __init__(self, nb_classes: int, nb_bins: int = 4000, min_logit: float = -105., max_logit: float = 20.):
+        """
+        :param nb_classes: number of classes (columns of the scores)
+        :param nb_bins: number of histogram bins per class
+        :param min_logit: lower bound of the bins (the smallest positive float32 has logit of about -103)
+        :param max_logit: upper bound of the bins (the largest float32 below 1 has logit of about 16.6)
+        """
+        self.nb_classes = nb_classes
+        self.nb_bins = nb_bins
+        self.min_logit = min_logit
+        self.max_logit = max_logit
+        self.positives = np.zeros((nb_classes, nb_bins), dtype=np.int64)
+        self.negatives = np.zeros((nb_classes, nb_bins), dtype=np.int64)
+
+    def update(self, y_true: np.ndarray, y_score: np.ndarray):
+        """
+        :param y_true: label ids of shape (nb_samples,)
+        :param y_score: predicted class scores of shape (nb_samples, nb_classes)
+        """
+        y_score = np.asarray(y_score, dtype=np.float64)
+        with np.errstate(divide='ignore'):
+            logits = np.log(y_score) - np.log1p(-y_score)
+        logits = np.clip(logits, self.min_logit, self.max_logit)
 
+        bins = ((logits - self.min_logit) / (self.max_logit - self.min_logit) * self.nb_bins).astype(np.int64)
+        bins = np.minimum(bins, self.nb_bins - 1)
+        bins += np.arange(self.nb_classes) * self.nb_bins
+        is_positive = y_true[:, None] == np.arange(self.nb_classes)
+        size = self.nb_classes * self.nb_bins
+        self.positives += np.bincount(bins[is_positive], minlength=size).reshape(self.positives.shape)
+        self.negatives += np.bincount(bins[~is_positive], minlength=size).reshape(self.negatives.shape)
 
-def multi_class_roc_auc_score(y_test, y_pred, average="macro"):
-    lb = LabelBinarizer()
-    lb.fit(y_test)
-    y_test = lb.transform(y_test)
-    y_pred = lb.transform(y_pred)
-    return roc_auc_score(y_test, y_pred, average=average)
+    def result(self) -> float:
+        nb_positives = self.positives.sum(axis=-1)
+        nb_negatives = self.negatives.sum(axis=-1)
+
+        ''' Each negative is ranked below the positives from higher bins and ties with the ones in the same bin '''
+        positives_above = nb_positives[:, None] - np.cumsum(self.positives, axis=-1)
+        ranked_pairs = (self.negatives * (positives_above + 0.5 * self.positives)).sum(axis=-1)
+
+        valid = (nb_positives > 0) & (nb_negatives > 0)
+        return float(np.mean(ranked_pairs[valid] / (nb_positives[valid] * nb_negatives[valid])))
 
 
 class Evaluate(Callback):
+    """
+    Evaluates the model on `data_generator` after each epoch (both raw and post-processed with `to_sample`)
+    The generator is expected to yield (inputs, labels, samples), labels are preferably ids (convert_one_hot=False)
+    """
     def __init__(self, data_generator: DataGenerator, to_sample,
                  nb_steps: int = None, prepend_str: str = 'val_'):
         super(Evaluate, self).__init__()
@@ -34,37 +106,38 @@ class Evaluate(Callback):
         Calculates:
          * word-level accuracy
          * char-level metrics: acc, loss, precision, recall, f1, auc, confusion matrix
+        :param predictions: batches of network outputs, each of shape (batch_size, nb_chars, nb_classes)
+        :param labels: batches of label ids, each of shape (batch_size, nb_chars)
         :return confusion_matrix, (word_acc, acc, loss, precision, recall, f1, auc)
         """
 
-        ''' Calculate word-level accuracy '''
-        correct = 0
-        nb_words = 0
+        ''' Accumulate the statistics batch by batch (batches can be padded to different lengths) '''
+        nb_classes = predictions[0].shape[-1]
+        correct_words, nb_words, loss = 0, 0, 0.
+        conf = np.zeros(nb_classes * nb_classes, dtype=np.int64)
+        auc = BinnedROCAUC(nb_classes=nb_classes)
         for batch_prediction, batch_label in zip(predictions, labels):
-            correct += sum([np.array_equal(np.argmax(word_prediction, axis=-1), np.argmax(word_label, axis=-1))
-                            for word_prediction, word_label in zip(batch_prediction, batch_label)])
+            batch_prediction_ids = np.argmax(batch_prediction, axis=-1)
+            correct_words += int(np.all(batch_prediction_ids == batch_label, axis=-1).sum())
             nb_words += len(batch_label)
 
-        ''' Calculate char-level metrics '''
-        char_predictions = []
-        char_labels = []
-        for batch_prediction, batch_label in zip(predictions, labels):
-            for word_prediction, word_label in zip(batch_prediction, batch_label):
-                char_predictions += word_prediction.tolist()
-                char_labels += word_label.tolist()
-
-        char_predictions = np.array(char_predictions)
-        char_labels = np.array(char_labels)
-
-        t, p = np.argmax(char_labels, axis=-1), np.argmax(char_predictions, axis=-1)
-        return tuple([('confusion_matrix', confusion_matrix(t, p)),
-                      ('word_acc', correct / nb_words),
-                      ('acc', accuracy_score(t, p)),
-                      ('loss', log_loss(char_labels, char_predictions)),
-                      ('precision', precision_score(t, p, average='macro')),
-                      ('recall', recall_score(t, p, average='macro')),
-                      ('f1', f1_score(t, p, average='macro')),
-                      ('auc', multi_class_roc_auc_score(t, p))])
+            t, p = np.asarray(batch_label).ravel(), batch_prediction_ids.ravel()
+            scores = np.asarray(batch_prediction, dtype=np.float32).reshape(-1, nb_classes)
+            conf += np.bincount(nb_classes * t + p, minlength=nb_classes * nb_classes)
+            loss += log_loss_sum(t, scores)
+            auc.update(t, scores)
+
+        conf = conf.reshape((nb_classes, nb_classes))
+        nb_chars = conf.sum()
+        precision, recall, f1 = macro_precision_recall_f1(conf)
+        return tuple([('confusion_matrix', conf),
+                      ('word_acc', correct_words / nb_words),
+                      ('acc', np.trace(conf) / nb_chars),
+                      ('loss', loss / nb_chars),
+                      ('precision', precision),
+                      ('recall', recall),
+                      ('f1', f1),
+                      ('auc', auc.result())])
 
     def on_epoch_end(self, epoch, logs=None):
         logs = logs or {}
@@ -73,9 +146,10 @@ class Evaluate(Callback):
         epoch_predictions = []
         epoch_samples = []
         all_samples = []
-        for i, (inputs, labels, samples) in zip(range(self.nb_steps), self.data_generator):
+        for i, (inputs, labels, samples) in zip(range(self.nb_steps),
+                                                PrefetchGenerator(self.data_generator)):
             predictions = self.model.predict(inputs)
-            epoch_labels.append(labels)
+            epoch_labels.append(labels if labels.ndim == 2 else np.argmax(labels, axis=-1))
             epoch_predictions.append(predictions)
             epoch_samples.append(samples)
             all_samples += samples
@@ -84,13 +158,15 @@ class Evaluate(Callback):
         for metric_name, metric_value in metrics:
             logs[self.prepend_str + metric_name] = metric_value
 
+        ''' `to_sample` overwrites each prediction with the one-hot encoding of the post-processed sample '''
         predicted_samples = []
-        for batch_prediction, batch_label, batch_samples in zip(epoch_predictions, epoch_labels, epoch_samples):
-            for word_prediction, word_label, word_sample in zip(batch_prediction, batch_label, batch_samples):
+        for batch_prediction, batch_samples in zip(epoch_predictions, epoch_samples):
+            for word_prediction, word_sample in zip(batch_prediction, batch_samples):
                 valid_sample = self.to_sample(word=word_sample.word, prediction=word_prediction)
                 predicted_samples.append(valid_sample)
         assert len(all_samples) == len(predicted_samples)
 
+        ''' Evaluate the post-processed predictions against the same (already reduced) labels '''
         metrics = self.evaluate(predictions=epoch_predictions, labels=epoch_labels)
         for metric_name, metric_value in metrics:
             logs[self.prepend_str + metric_name + '_processed'] = metric_value
@@ -98,8 +174,11 @@ class Evaluate(Callback):
         print(f'\nEvaluating for epoch {epoch + 1}...')
         pprint({k: v for k, v in logs.items() if isinstance(v, (int, float, str))})
 
-        correct = [(pred, correct) for correct, pred in zip(all_samples, predicted_samples) if pred == correct]
-        wrong = [(pred,   correct) for correct, pred in zip(all_samples, predicted_samples) if pred != correct]
-        print('Sample accuracy:', len(correct) / len(all_samples))
+        ''' Compare each prediction only once and split the samples by the mask '''
+        is_correct = np.fromiter((pred == correct for correct, pred in zip(all_samples, predicted_samples)),
+                                 dtype=bool, count=len(all_samples))
+        correct = [(predicted_samples[i], all_samples[i]) for i in np.flatnonzero(is_correct)]
+        wrong = [(predicted_samples[i],   all_samples[i]) for i in np.flatnonzero(~is_correct)]
+        print('Sample accuracy:', is_correct.mean())
 
         return correct, wrong, predicted_samples